@@ -8,3 +8,15 @@ MISSING_SAMPLES_DESC = ("How to handle missing samples in metadata. 'error' "
                         "are retained.")
 SAMPLE_CLASS_DESC = "Sample classifier trained with fit_classifier."
 SAMPLE_REGR_DESC = "Sample regressor trained with fit_regressor."
+CACHE_DIR_DESC = ("Directory to cache the parsed dataset in. The cache is "
+                  "written on the first epoch and reused by later epochs "
+                  "and runs. Delete it if the table or metadata change.")
+SNAPSHOT_DIR_DESC = ("Directory to snapshot the parsed dataset in. The "
+                     "snapshot is written by the first run and read back "
+                     "by later runs. Delete it if the table or metadata "
+                     "change.")
+BUCKET_BATCHES_DESC = ("Batch training samples with a similar number of "
+                       "features together to reduce padding.")
+DATA_SERVICE_DESC = ("Address of a tf.data service dispatcher that runs the "
+                     "training input pipeline, or 'local' to start a "
+                     "dispatcher and worker in this process.")
@@ -1,6 +1,7 @@
 import os
-import scipy
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import pandas as pd
 import tensorflow as tf
 import matplotlib.pyplot as plt
 import sklearn
@@ -9,49 +10,81 @@ from skbio.stats.distance import DistanceMatrix
 import skbio.stats.ordination
 from biom import load_table
 from aam.data_utils import (
-    get_sequencing_dataset, get_unifrac_dataset, combine_datasets,
+    get_sequencing_dataset, get_unifrac_matrix, combine_datasets,
     batch_dataset,
 )
-from unifrac import unweighted
-
-
-def mean_confidence_interval(data, confidence=0.95):
-    a = 1.0 * np.array(data)
-    n = len(a)
-    m, se = np.mean(a), scipy.stats.sem(a)
-    h = se * scipy.stats.t.ppf((1 + confidence) / 2., n-1)
-    return m, h
-
-
-def mean_absolute_error(mean, std, dataset, model, fname, epoch):
-    pred_val = tf.squeeze(model.predict(dataset)).numpy()*std + mean
-    true_val = np.concatenate([tf.squeeze(ys).numpy() for (_, ys) in dataset])
-    true_val = true_val*std + mean
-    mae, h = mean_confidence_interval(np.abs(true_val - pred_val))
-
-    min_x = np.min(true_val)
-    max_x = np.max(true_val)
-    coeff = np.polyfit(true_val, pred_val, deg=1)
-    p = np.poly1d(coeff)
-    xx = np.linspace(min_x, max_x, 1000)
-    yy = p(xx)
-
-    diag = np.polyfit(true_val, true_val, deg=1)
-    p = np.poly1d(diag)
-    diag_xx = np.linspace(min_x, max_x, 1000)
-    diag_yy = p(diag_xx)
-
-    plt.figure(figsize=(4, 4))
-    plt.subplot(1, 1, 1)
-    plt.scatter(true_val, pred_val, 7, marker='.', c='grey', alpha=0.5)
-    plt.plot(xx, yy)
-    plt.plot(diag_xx, diag_yy)
-    mae, h = '%.4g' % mae, '%.4g' % h
-    plt.xlabel('True Value')
-    plt.ylabel('Predicted Value')
-    plt.title(f"MAE: {mae}  {h} (epoch: {epoch})")
-    plt.savefig(fname)
-    plt.close()
+from aam.plotting import plot_mean_absolute_error, submit_plot
+
+
+def _forward_step(model):
+    """Inference step for `model`. Callbacks build it once in set_model so
+    every report reuses the same trace.
+    """
+    @tf.function(reduce_retracing=True)
+    def step(x):
+        return model(x, training=False)
+    return step
+
+
+def _predict(step, dataset, with_labels=False):
+    """Predictions from a forward step over `dataset`. Avoids the per-batch
+    overhead of model.predict and keeps the result on device. With
+    `with_labels` the labels are collected in the same pass and both are
+    copied to the host once at the end.
+    """
+    pred_val = []
+    true_val = []
+    for data in dataset:
+        x, y, _ = tf.keras.utils.unpack_x_y_sample_weight(data)
+        pred_val.append(step(x))
+        if with_labels:
+            true_val.append(y)
+    pred_val = tf.concat(pred_val, axis=0)
+    if not with_labels:
+        return pred_val
+    return (tf.squeeze(pred_val).numpy(),
+            tf.squeeze(tf.concat(true_val, axis=0)).numpy())
+
+
+@tf.function(jit_compile=True)
+def _pcoa_coordinates(distances, number_of_dimensions):
+    # double centering of -0.5 * D**2, equivalent to -0.5 * H @ D**2 @ H
+    # with H the centering matrix but without the matmuls
+    centered = -0.5 * tf.square(distances)
+    centered = (centered
+                - tf.reduce_mean(centered, axis=0, keepdims=True)
+                - tf.reduce_mean(centered, axis=1, keepdims=True)
+                + tf.reduce_mean(centered))
+
+    # eigh returns the eigenvalues in ascending order
+    eigvals, eigvecs = tf.linalg.eigh(centered)
+    eigvals = tf.reverse(eigvals[-number_of_dimensions:], axis=[0])
+    eigvecs = tf.reverse(eigvecs[:, -number_of_dimensions:], axis=[1])
+    coordinates = eigvecs * tf.sqrt(tf.maximum(eigvals, 0.0))
+    return eigvals, coordinates, tf.linalg.trace(centered)
+
+
+def _pcoa(distance_matrix, number_of_dimensions=3):
+    """Principal coordinate analysis of a skbio DistanceMatrix computed with
+    TensorFlow so it runs on the accelerator when one is available. Returns
+    an skbio OrdinationResults with the leading `number_of_dimensions` axes.
+    """
+    eigvals, coordinates, total = _pcoa_coordinates(
+        tf.constant(distance_matrix.data, dtype=tf.float32),
+        number_of_dimensions
+    )
+    eigvals = eigvals.numpy()
+    axis_labels = [f'PC{i + 1}' for i in range(number_of_dimensions)]
+    return skbio.stats.ordination.OrdinationResults(
+        short_method_name='PCoA',
+        long_method_name='Principal Coordinate Analysis',
+        eigvals=pd.Series(eigvals, index=axis_labels),
+        samples=pd.DataFrame(coordinates.numpy(),
+                             index=distance_matrix.ids,
+                             columns=axis_labels),
+        proportion_explained=pd.Series(eigvals / total.numpy(),
+                                       index=axis_labels)
+    )
 
 
 class MAE_Scatter(tf.keras.callbacks.Callback):
@@ -71,14 +104,23 @@ class MAE_Scatter(tf.keras.callbacks.Callback):
         self.dataset = dataset
         self.out_dir = out_dir
         self.report_back_after_epochs = report_back_after_epochs
+        self._plot = None
+
+    def set_model(self, model):
+        super().set_model(model)
+        self._predict_step = _forward_step(model)
 
     def on_epoch_end(self, epoch, logs=None):
         if epoch % self.report_back_after_epochs == 0:
-            mean_absolute_error(
-                self.mean,
-                self.std,
-                self.dataset,
-                self.model,
+            # predict on the training thread, plot while the next epoch runs
+            pred_val, true_val = _predict(self._predict_step,
+                                          self.dataset,
+                                          with_labels=True)
+            self._wait_for_plot()
+            self._plot = submit_plot(
+                plot_mean_absolute_error,
+                pred_val*self.std + self.mean,
+                true_val*self.std + self.mean,
                 fname=os.path.join(
                     self.out_dir, f'MAE-{self.title}-epoch-{epoch}.png'
                     ),
@@ -86,24 +128,47 @@ class MAE_Scatter(tf.keras.callbacks.Callback):
             )
         return super().on_epoch_end(epoch, logs)
 
+    def on_train_end(self, logs=None):
+        self._wait_for_plot()
+        return super().on_train_end(logs)
+
+    def _wait_for_plot(self):
+        if self._plot is not None:
+            self._plot.result()
+            self._plot = None
+
 
 class SaveModel(tf.keras.callbacks.Callback):
-    def __init__(self, output_dir, **kwargs):
+    def __init__(self, output_dir, full_save_every=25, **kwargs):
         super().__init__(**kwargs)
         self.output_dir = output_dir
+        self.full_save_every = full_save_every
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-    def on_epoch_end(self, epoch, logs=None):
+    def _save_model(self):
         self.model.save(
             os.path.join(self.output_dir, 'model.keras'),
             save_format='keras'
         )
 
+    def on_epoch_end(self, epoch, logs=None):
+        # weights are cheap to write every epoch, the full model with its
+        # optimizer and config is only serialized at milestones
+        self.model.save_weights(
+            os.path.join(self.output_dir, 'model.weights.h5')
+        )
+        if epoch % self.full_save_every == 0:
+            self._save_model()
+
+    def on_train_end(self, logs=None):
+        self._save_model()
+
     def get_config(self):
         base_config = super().get_config()
         config = {
-            "output_dir": self.output_dir
+            "output_dir": self.output_dir,
+            "full_save_every": self.full_save_every
         }
         return {**base_config, **config}
 
@@ -113,8 +178,10 @@ class ProjectEncoder(tf.keras.callbacks.Callback):
                  i_table,
                  i_tree,
                  output_dir,
-                 batch_size):
+                 batch_size,
+                 report_back_after_epochs=5):
         super().__init__()
+        self.report_back_after_epochs = report_back_after_epochs
         self.i_table = i_table
         self.i_tree = i_tree
         self.batch_size = batch_size
@@ -122,17 +189,20 @@ class ProjectEncoder(tf.keras.callbacks.Callback):
         self.output_dir = output_dir
         self.cur_step = 0
         self.num_samples = 250
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pcoa = None
         seq_dataset = get_sequencing_dataset(i_table)
-        unifrac_dataset = get_unifrac_dataset(i_table, i_tree)
+        self.distances = get_unifrac_matrix(i_table, i_tree)
         dataset = combine_datasets(seq_dataset,
-                                   unifrac_dataset,
+                                   None,
                                    100,
                                    add_index=True)
         self.dataset = batch_dataset(dataset,
                                      batch_size,
                                      shuffle=False,
                                      repeat=1,
-                                     is_pairwise=True)
+                                     is_pairwise=True,
+                                     distances=self.distances)
 
     def _log_epoch_data(self):
         tf.print('loggin data...')
@@ -142,36 +212,55 @@ class ProjectEncoder(tf.keras.callbacks.Callback):
         sample_indices = np.arange(total_samples)
         np.random.shuffle(sample_indices)
         sample_indices = sample_indices[:self.num_samples]
-        pred = self.model.predict(self.dataset)
+        pred = _predict(self._predict_step, self.dataset)
 
         pred = tf.gather(pred, sample_indices)
-        distances = _pairwise_distances(pred, squared=False)
+        distances = _pairwise_distances(pred, squared=False).numpy()
+
+        # the PCoAs and UniFrac only need host data so they run in the
+        # background while training continues
+        self._wait_for_pcoa()
+        self._pcoa = self._executor.submit(self._write_pcoa,
+                                           distances,
+                                           sample_indices)
+
+    def _write_pcoa(self, distances, sample_indices):
+        sample_ids = self.table.ids(axis='sample')[sample_indices]
         pred_unifrac_distances = DistanceMatrix(
-            distances.numpy(),
-            self.table.ids(axis='sample')[sample_indices],
+            distances,
+            sample_ids,
             validate=False
         )
-        pred_pcoa = skbio.stats.ordination.pcoa(pred_unifrac_distances,
-                                                method='fsvd',
-                                                number_of_dimensions=3,
-                                                inplace=True)
+        pred_pcoa = _pcoa(pred_unifrac_distances, number_of_dimensions=3)
         pred_pcoa.write(os.path.join(self.output_dir, 'pred_pcoa.pcoa'))
 
-        true_unifrac_distances = unweighted(
-                self.i_table, self.i_tree
-                ).filter(self.table.ids(axis='sample')[sample_indices])
-        true_pcoa = skbio.stats.ordination.pcoa(true_unifrac_distances,
-                                                method='fsvd',
-                                                number_of_dimensions=3,
-                                                inplace=True)
+        true_unifrac_distances = DistanceMatrix(
+            self.distances.numpy(),
+            self.table.ids(axis='sample'),
+            validate=False
+        ).filter(sample_ids)
+        true_pcoa = _pcoa(true_unifrac_distances, number_of_dimensions=3)
         true_pcoa.write(os.path.join(self.output_dir, 'true_pcoa.pcoa'))
 
+    def _wait_for_pcoa(self):
+        if self._pcoa is not None:
+            self._pcoa.result()
+            self._pcoa = None
+
+    def set_model(self, model):
+        super().set_model(model)
+        self._predict_step = _forward_step(model)
+
     def on_epoch_end(self, epoch, logs=None):
-        if self.cur_step % 5 == 0:
+        if self.cur_step % self.report_back_after_epochs == 0:
             self._log_epoch_data()
             self.cur_step = 0
         self.cur_step += 1
 
+    def on_train_end(self, logs=None):
+        self._wait_for_pcoa()
+        return super().on_train_end(logs)
+
 
 class Accuracy(tf.keras.callbacks.Callback):
     def __init__(self, title, dataset, out_dir):
@@ -180,11 +269,15 @@ class Accuracy(tf.keras.callbacks.Callback):
         self.dataset = dataset
         self.out_dir = out_dir
 
+    def set_model(self, model):
+        super().set_model(model)
+        self._predict_step = _forward_step(model)
+
     def on_epoch_end(self, epoch, logs=None):
         if epoch % 5 == 0:
-            pred_cat = tf.squeeze(self.model.predict(self.dataset)).numpy()
-            true_cat = np.concatenate([tf.squeeze(ys).numpy() for (_, ys) in
-                                       self.dataset])
+            pred_cat, true_cat = _predict(self._predict_step,
+                                          self.dataset,
+                                          with_labels=True)
 
             def plot_prc(name, labels, predictions, **kwargs):
                 precision, recall, _ = sklearn.metrics.precision_recall_curve(
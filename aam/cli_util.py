@@ -24,6 +24,14 @@ def aam_model_options(func):
             show_default=True,
             type=int
         ),
+        click.option(
+            '--p-warmup-epochs',
+            default=10,
+            show_default=True,
+            help='Epochs to train before early stopping starts watching '
+                 'the loss.',
+            type=int
+        ),
         click.option(
             '--p-repeat',
             default=5,
@@ -95,6 +103,19 @@ def aam_model_options(func):
             show_default=True,
             type=int
         ),
+        click.option(
+            '--p-xla/--p-no-xla',
+            default=None,
+            help='Let XLA cluster the numeric ops of the training step. '
+                 'Defaults to on when a GPU is available.'
+        ),
+        click.option(
+            '--p-mixed-precision/--p-no-mixed-precision',
+            default=False,
+            show_default=True,
+            help='Train with the mixed_float16 policy. The output heads '
+                 'stay in float32.'
+        ),
     ]
 
     for option in reversed(model_options):
@@ -1,8 +1,10 @@
+import functools
 import numpy as np
 import pandas as pd
 import tensorflow as tf
 from biom import load_table
 from unifrac import unweighted
+from aam.dataset_options import pipeline_options
 
 
 def align_table_and_metadata(table_path,
@@ -32,7 +34,7 @@ def get_sequencing_dataset(table_path):
     row_ind = data.row
     col_ind = data.col
     values = data.data
-    indices = [[r, c] for r, c in zip(row_ind, col_ind)]
+    indices = np.stack((row_ind, col_ind), axis=1).astype(np.int64)
     table_data = tf.sparse.SparseTensor(indices=indices, values=values,
                                         dense_shape=table.shape)
     table_data = tf.sparse.reorder(table_data)
@@ -52,7 +54,7 @@ def convert_table_to_dataset(table, include_count=True):
     row_ind = table_coo.row
     col_ind = table_coo.col
     values = table_coo.data
-    indices = [[r, c] for r, c in zip(row_ind, col_ind)]
+    indices = np.stack((row_ind, col_ind), axis=1).astype(np.int64)
     sparse_tensor = tf.sparse.SparseTensor(
         indices=indices,
         values=values,
@@ -88,42 +90,77 @@ def get_unifrac_dataset(table_path, tree_path):
             .prefetch(tf.data.AUTOTUNE))
 
 
+def get_unifrac_matrix(table_path, tree_path):
+    """UniFrac distances as one constant so pairwise batches can gather their
+    block by sample index instead of carrying it through the pipeline.
+    """
+    distance = unweighted(table_path, tree_path).data
+    return tf.constant(distance, dtype=tf.float32)
+
+
+@functools.lru_cache(maxsize=None)
+def _nucleotide_table():
+    return tf.lookup.StaticHashTable(
+        tf.lookup.KeyValueTensorInitializer(
+            tf.constant([b'A', b'C', b'G', b'T', b'N']),
+            tf.constant([2, 3, 4, 5, 6], dtype=tf.int64)
+        ),
+        default_value=1
+    )
+
+
+def sequence_tokenizer(max_bp):
+    """Character tokenizer for nucleotide sequences. Uses the same layout as
+    a character TextVectorization (0 for padding, 1 for unknown characters)
+    but with a fixed vocabulary so nothing has to be adapted.
+    """
+    table = _nucleotide_table()
+
+    def tokenize(seq):
+        # sequences arrive as [n, 1] from get_sequencing_dataset
+        seq = tf.reshape(seq, [-1])
+        nucleotides = tf.strings.bytes_split(tf.strings.upper(seq))
+        tokens = tf.ragged.map_flat_values(table.lookup, nucleotides)
+        return tokens.to_tensor(default_value=0, shape=[None, max_bp])
+    return tokenize
+
+
 def combine_datasets(
     seq_dataset,
     dist_dataset,
     max_bp,
     add_index=False,
-    contains_rclr=False
+    contains_rclr=False,
+    tokenize_batch_size=64
 ):
-    sequence_tokenizer = tf.keras.layers.TextVectorization(
-        max_tokens=7,
-        split='character',
-        output_mode='int',
-        output_sequence_length=max_bp,
-    )
+    tokenize_seq = sequence_tokenizer(max_bp)
+    dataset_size = seq_dataset.cardinality()
+
+    def tokenize_batch(seq):
+        return seq.with_flat_values(tokenize_seq(seq.flat_values))
 
     if not contains_rclr:
-        sequence_tokenizer.adapt(seq_dataset.take(1))
-        seq_dataset = seq_dataset.map(lambda x: sequence_tokenizer(x))
+        tokenize = tokenize_batch
     else:
-        tokens = seq_dataset.map(lambda x, y: x)
-        sequence_tokenizer.adapt(tokens.take(1))
-
         def tokenize(seq, rclr):
-            return (sequence_tokenizer(seq), rclr)
-        seq_dataset = seq_dataset.map(tokenize)
-    dataset_size = seq_dataset.cardinality()
+            return (tokenize_batch(seq), rclr)
+
+    # samples are tokenized a batch at a time so the string ops run once per
+    # batch rather than once per sample
+    seq_dataset = (
+        seq_dataset
+        .ragged_batch(tokenize_batch_size)
+        .map(tokenize, num_parallel_calls=tf.data.AUTOTUNE)
+        .unbatch()
+        .apply(tf.data.experimental.assert_cardinality(dataset_size))
+    )
 
+    zip = (seq_dataset,)
     if add_index:
-        zip = (tf.data.Dataset.range(dataset_size),
-               seq_dataset,
-               dist_dataset)
-    else:
-        zip = (seq_dataset,
-               dist_dataset)
-    return (tf.data.Dataset
-            .zip(*zip)
-            .prefetch(tf.data.AUTOTUNE))
+        zip = (tf.data.Dataset.range(dataset_size),) + zip
+    if dist_dataset is not None:
+        zip = zip + (dist_dataset,)
+    return tf.data.Dataset.zip(*zip)
 
 
 def batch_dataset(
@@ -132,7 +169,8 @@ def batch_dataset(
     shuffle=False,
     repeat=1,
     is_pairwise=False,
-    include_count=True
+    include_count=True,
+    distances=None
 ):
     dataset = dataset.cache()
     size = dataset.cardinality()
@@ -141,17 +179,21 @@ def batch_dataset(
         dataset = dataset.shuffle(size, reshuffle_each_iteration=True)
 
     if is_pairwise:
-        def extract_zip(ind, seq, dist):
-            return (seq, tf.gather(dist, ind, axis=1, batch_dims=0))
+        # the [B, B] block of distances between the samples of a batch is
+        # gathered once the batch is formed so distances are never cached
+        # or copied per sample
+        def extract_zip(ind, seq):
+            block = tf.gather(tf.gather(distances, ind), ind, axis=1)
+            return (ind, seq, block)
 
-        def step_pad(ind, seq, dist):
+        def step_pad(ind, seq):
             ASV_DIM = 0
             FACTOR = 32
             shape = tf.shape(seq)[ASV_DIM]
             pad = shape // FACTOR * FACTOR + FACTOR - shape
-            return (ind, tf.pad(seq, [[0, pad], [0, 0]]), dist)
+            return (ind, tf.pad(seq, [[0, pad], [0, 0]]))
 
-        padded_shape = ([], [None, 100], [None])
+        padded_shape = ([], [None, 100])
     elif not include_count:
         def extract_zip(seq, y):
             return (seq, y)
@@ -198,11 +240,17 @@ def batch_dataset(
             padded_shapes=padded_shape,
             drop_remainder=True
         )
-        .prefetch(tf.data.AUTOTUNE)
     )
 
     dataset = dataset.repeat(repeat)
     if not shuffle:
         dataset = dataset.cache()
+    if is_pairwise:
+        dataset = dataset.map(extract_zip,
+                              num_parallel_calls=tf.data.AUTOTUNE)
 
-    return dataset.prefetch(tf.data.AUTOTUNE)
+    return (
+        dataset
+        .prefetch(tf.data.AUTOTUNE)
+        .with_options(pipeline_options(shuffle))
+    )
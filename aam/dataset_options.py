@@ -0,0 +1,13 @@
+import tensorflow as tf
+
+
+def pipeline_options(shuffle=False):
+    """tf.data options shared by the batched training pipelines."""
+    options = tf.data.Options()
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.parallel_batch = True
+    if shuffle:
+        # element order is already random so let the parallel maps hand out
+        # whichever element is ready first
+        options.deterministic = False
+    return options
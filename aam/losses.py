@@ -1,7 +1,24 @@
+import numpy as np
 import tensorflow as tf
 from math import comb
 
 
+def _squared_distances(embeddings):
+    """Pairwise squared euclidean distances of a (batch_size, embed_dim)
+    tensor. Not a tf.function on its own so that callers tracing it under
+    jit_compile get the add/sub/relu fused into the matmul epilogue.
+    """
+    # ||a - b||^2 = ||a||^2  - 2 <a, b> + ||b||^2
+    # The squared norms are the diagonal of the gram matrix, which keeps the
+    # diagonal of the result exactly 0. relu clamps the small negative
+    # values caused by computation errors.
+    dot_product = tf.matmul(embeddings, embeddings, transpose_b=True)
+    square_norm = tf.linalg.diag_part(dot_product)
+    return tf.nn.relu(
+        square_norm[:, None] + square_norm[None, :] - 2.0 * dot_product
+    )
+
+
 @tf.function(jit_compile=True)
 def _pairwise_distances(embeddings, squared=False):
     """Compute the 2D matrix of distances between all the embeddings.
@@ -13,75 +30,109 @@ def _pairwise_distances(embeddings, squared=False):
     Returns:
         pairwise_distances: tensor of shape (batch_size, batch_size)
     """
-    # Get the dot product between all embeddings
-    # shape (batch_size, batch_size)
-    dot_product = tf.matmul(embeddings, tf.transpose(embeddings))
-
-    # Get squared L2 norm for each embedding. We can just take the diagonal of
-    # `dot_product`.
-    # This also provides more numerical stability (the diagonal of the result
-    # will be exactly 0).
-    # shape (batch_size,)
-    square_norm = tf.linalg.diag_part(dot_product)
+    distances = _squared_distances(embeddings)
 
-    # Compute the pairwise distance matrix as we have:
-    # ||a - b||^2 = ||a||^2  - 2 <a, b> + ||b||^2
-    # shape (batch_size, batch_size)
-    distances = (tf.expand_dims(square_norm, 1) - 2.0 * dot_product +
-                 tf.expand_dims(square_norm, 0))
+    if not squared:
+        # The epsilon keeps the gradient of sqrt finite where
+        # distances == 0.0. The diagonal is then set back to exactly 0.0
+        distances = tf.sqrt(distances + 1e-12)
+        distances = tf.linalg.set_diag(
+            distances,
+            tf.zeros_like(tf.linalg.diag_part(distances))
+        )
 
-    # Because of computation errors, some distances might be negative so we
-    # put everything >= 0.0
-    distances = tf.maximum(distances, 0.0)
+    return distances
 
-    if not squared:
-        # Because the gradient of sqrt is infinite when distances == 0.0
-        # (ex: on the diagonal)
-        # we need to add a small epsilon where distances == 0.0
-        mask = tf.cast(tf.equal(distances, 0.0), tf.float32)
-        distances = distances + mask * 1e-16
 
-        distances = tf.sqrt(distances)
+def _upper_triangular_mask(size):
+    """Mask selecting the upper triangle (diagonal included) of a
+    (size, size) matrix. Built once per loss so the per-step graph only has
+    to multiply by a constant.
+    """
+    return tf.constant(np.triu(np.ones((size, size), dtype=np.float32)))
 
-        # Correct the epsilon added: set the distances on the mask to be
-        # exactly 0.0
-        distances = distances * (1.0 - mask)
 
-    return distances
+def _upper_triangular_indices(batch_size):
+    """Row and column indices of the strict upper triangle of a
+    (batch_size, batch_size) matrix, i.e. the comb(batch_size, 2) pairs.
+    """
+    i_idx, j_idx = np.triu_indices(batch_size, k=1)
+    return (tf.constant(i_idx, dtype=tf.int32),
+            tf.constant(j_idx, dtype=tf.int32))
+
+
+def _abs_residuals(ys, i_idx, j_idx):
+    """Absolute residuals |y_i - y_j| for the pairs (i_idx, j_idx) of a 1D
+    tensor.
+    """
+    return tf.abs(tf.gather(ys, i_idx) - tf.gather(ys, j_idx))
+
 
+def pairwise_loss(batch_size, tile_size=64):
+    """Squared error between the true pairwise distances and the squared
+    pairwise distances of the predicted embeddings, averaged over the upper
+    triangle.
 
-def pairwise_loss(batch_size):
-    @tf.function(jit_compile=True)
+    The upper triangle is processed in row strips of `tile_size` so at most
+    a (tile_size, batch_size) block of distances is live at a time and the
+    blocks below the diagonal are never computed.
+    """
+    strips = [
+        (start, min(start + tile_size, batch_size))
+        for start in range(0, batch_size, tile_size)
+    ]
+    # only the square block on the diagonal of each strip needs masking
+    mask = _upper_triangular_mask(min(tile_size, batch_size))
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def inner(y_true, y_pred):
+        # the strips are laid out for `batch_size` rows
+        y_pred = tf.ensure_shape(y_pred, [batch_size, None])
+        y_true = tf.ensure_shape(y_true, [batch_size, batch_size])
         y_true = tf.math.square(y_true)
-        y_pred_dist = _pairwise_distances(y_pred, squared=True)
-        difference = tf.math.square(y_true - y_pred_dist)
-        difference = tf.linalg.band_part(difference, 0, -1)
-        return tf.reduce_sum(difference) / comb(batch_size, 2)
+        # only used for the blocks right of the diagonal
+        square_norm = tf.reduce_sum(tf.math.square(y_pred), axis=-1)
+        loss = tf.constant(0.0)
+        for start, end in strips:
+            rows = end - start
+            # the block on the diagonal goes through _squared_distances so
+            # its diagonal stays exactly 0
+            difference = tf.math.square(
+                y_true[start:end, start:end] -
+                _squared_distances(y_pred[start:end])
+            )
+            loss += tf.reduce_sum(difference * mask[:rows, :rows])
+            if end == batch_size:
+                continue
+            dot_product = tf.matmul(
+                y_pred[start:end], y_pred[end:], transpose_b=True
+            )
+            y_pred_dist = tf.nn.relu(
+                square_norm[start:end, None] + square_norm[None, end:] -
+                2.0 * dot_product
+            )
+            loss += tf.reduce_sum(
+                tf.math.square(y_true[start:end, end:] - y_pred_dist)
+            )
+        return loss / comb(batch_size, 2)
     return inner
 
 
 def pairwise_residual_mse(batch_size, mean=None, std=None):
-    @tf.function(jit_compile=True)
-    def sqrt_res(ys):
-        r = tf.reshape(ys, shape=(-1, 1)) - tf.reshape(ys, shape=(1, -1))
-        r = tf.square(r)
-        r_mask = tf.cast(tf.equal(r, 0.0), tf.float32)
-        r = r + r_mask * 1e-16
-        r = tf.sqrt(r)
-        return r * (1.0 - r_mask)
-
-    @tf.function(jit_compile=True)
+    i_idx, j_idx = _upper_triangular_indices(batch_size)
+    scale = _error_scale(mean, std)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def inner(y_true, y_pred):
-        if mean is not None:
-            y_true = denormalize(y_true, mean, std)
-            y_pred = denormalize(y_pred, mean, std)
-        y_true = tf.squeeze(y_true)
-        y_pred = tf.squeeze(y_pred)
-        mse = tf.reduce_sum(tf.square(y_true - y_pred)) / batch_size
-        r_yt = sqrt_res(y_true)
-        r_yp = sqrt_res(y_pred)
-        rse = tf.linalg.band_part(tf.square(r_yt - r_yp), 0, -1)
+        # the pair indices are laid out for `batch_size` samples and XLA
+        # clamps out of range gathers instead of failing
+        y_true = tf.ensure_shape(tf.squeeze(y_true), [batch_size])
+        y_pred = tf.ensure_shape(tf.squeeze(y_pred), [batch_size])
+        mse = tf.reduce_sum(tf.square((y_true - y_pred) * scale)) / batch_size
+        rse = tf.square(
+            (_abs_residuals(y_true, i_idx, j_idx) -
+             _abs_residuals(y_pred, i_idx, j_idx)) * scale
+        )
         mrse = tf.reduce_sum(rse) / comb(batch_size, 2)
         return mse + mrse
     return inner
@@ -91,20 +142,29 @@ def denormalize(tensor, mean, std):
     return tensor*std + mean
 
 
+def _error_scale(mean, std):
+    """Scale to apply to the error between two normalized tensors so it is
+    the error between the denormalized tensors. The mean cancels since
+    denormalize(a) - denormalize(b) == std * (a - b).
+    """
+    return 1.0 if mean is None else std
+
+
 def mae_loss(mean=None, std=None):
+    scale = _error_scale(mean, std)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def mae(y_true, y_pred):
-        if mean is not None:
-            y_true = denormalize(y_true, mean, std)
-            y_pred = denormalize(y_pred, mean, std)
-        return tf.abs(y_true - y_pred)
+        return tf.abs((y_true - y_pred) * scale)
     return mae
 
 
 def mse_loss(mean=None, std=None):
+    scale = _error_scale(mean, std)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def mse(y_true, y_pred):
-        y_true = denormalize(y_true, mean, std)
-        y_pred = denormalize(y_pred, mean, std)
-        return tf.square(y_true - y_pred)
+        return tf.square((y_true - y_pred) * scale)
     return mse
 
 
@@ -1,8 +1,14 @@
 import tensorflow as tf
-from aam.losses import _pairwise_distances, mae_loss
+from math import comb
+from aam.losses import (
+    _pairwise_distances, _upper_triangular_indices, mae_loss
+)
 
 
 def pairwise_mae(batch_size):
+    i_idx, j_idx = _upper_triangular_indices(batch_size)
+    pair_idx = i_idx * batch_size + j_idx
+
     @tf.keras.saving.register_keras_serializable(
         package="metrics"
     )
@@ -17,10 +23,18 @@ def pairwise_mae(batch_size):
                                      dtype=tf.float32)
 
         def update_state(self, y_true, y_pred, sample_weight):
-            pairwise_mae = tf.abs(_pairwise_distances(y_pred) - y_true)
+            # pair_idx is laid out for a (batch_size, batch_size) y_true
+            y_true = tf.ensure_shape(y_true, [batch_size, batch_size])
+            y_pred = tf.ensure_shape(y_pred, [batch_size, None])
+            # only the comb(batch_size, 2) pairs above the diagonal
+            pred_dist = tf.gather(
+                tf.reshape(_pairwise_distances(y_pred), [-1]),
+                pair_idx
+            )
+            true_dist = tf.gather(tf.reshape(y_true, [-1]), pair_idx)
+            pairwise_mae = tf.abs(pred_dist - true_dist)
             self.loss.assign_add(tf.reduce_sum(pairwise_mae))
-            COMPARISONS = (batch_size * batch_size) - batch_size / 2.0
-            self.i.assign_add(tf.constant(COMPARISONS, dtype=tf.float32))
+            self.i.assign_add(float(comb(batch_size, 2)))
 
         def result(self):
             return self.loss / self.i
@@ -0,0 +1,84 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import scipy
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+# Figures are rendered in a separate process so matplotlib does not hold the
+# GIL while training runs. spawn avoids forking the TensorFlow runtime. The
+# worker still re-imports the entry script as __mp_main__, so with
+# `python cli.py` it loads everything cli.py imports. This module only
+# keeps the plotting code itself free of TensorFlow.
+_PLOT_EXECUTOR = ProcessPoolExecutor(
+    max_workers=1,
+    mp_context=multiprocessing.get_context('spawn')
+)
+
+
+def submit_plot(fn, *args, **kwargs):
+    """Runs the plotting function `fn` in the plotting process. Returns a
+    future for it.
+    """
+    return _PLOT_EXECUTOR.submit(fn, *args, **kwargs)
+
+
+def mean_confidence_interval(data, confidence=0.95):
+    a = 1.0 * np.array(data)
+    n = len(a)
+    m, se = np.mean(a), scipy.stats.sem(a)
+    h = se * scipy.stats.t.ppf((1 + confidence) / 2., n-1)
+    return m, h
+
+
+def _regression_line(true_val, pred_val, num):
+    """`num` points on the closed form least squares fit of pred_val on
+    true_val, spanning the range of true_val.
+    """
+    x_mean = true_val.mean()
+    y_mean = pred_val.mean()
+    slope = (((true_val - x_mean) * (pred_val - y_mean)).sum()
+             / ((true_val - x_mean)**2).sum())
+    intercept = y_mean - slope*x_mean
+    xx = np.linspace(np.min(true_val), np.max(true_val), num)
+    return xx, slope*xx + intercept
+
+
+def plot_mean_absolute_error(pred_val, true_val, fname, epoch):
+    mae, h = mean_confidence_interval(np.abs(true_val - pred_val))
+
+    xx, yy = _regression_line(true_val, pred_val, 1000)
+    plt.figure(figsize=(4, 4))
+    plt.subplot(1, 1, 1)
+    plt.scatter(true_val, pred_val, 7, marker='.', c='grey', alpha=0.5)
+    plt.plot(xx, yy)
+    plt.plot(xx, xx)
+    mae, h = '%.4g' % mae, '%.4g' % h
+    plt.xlabel('True Value')
+    plt.ylabel('Predicted Value')
+    plt.title(f"MAE: {mae}  {h} (epoch: {epoch})")
+    plt.savefig(fname)
+    plt.close()
+
+
+def plot_mae_scatter(pred_val, true_val, hue, hue_label, fname):
+    mae = np.mean(np.abs(true_val - pred_val))
+
+    xx, yy = _regression_line(true_val, pred_val, 50)
+    data = {"pred": pred_val, "true": true_val}
+    if hue is not None:
+        data[hue_label] = hue
+        data = pd.DataFrame(data=data)
+        plot = sns.scatterplot(data, x="true", y="pred", hue=hue_label)
+    else:
+        data = pd.DataFrame(data=data)
+        plot = sns.scatterplot(data, x="true", y="pred")
+    plt.plot(xx, yy)
+    plt.plot(xx, xx)
+    mae = '%.4g' % mae
+    plot.set(xlabel='True')
+    plot.set(ylabel='Predicted')
+    plot.set(title=f"MAE: {mae}")
+    plt.savefig(fname)
+    plt.close()
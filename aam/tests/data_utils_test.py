@@ -0,0 +1,80 @@
+import unittest
+import numpy as np
+import tensorflow as tf
+from aam.data_utils import (
+    sequence_tokenizer, combine_datasets, batch_dataset
+)
+
+
+class TestSequenceTokenizer(unittest.TestCase):
+
+    def test_tokenize_column(self):
+        tokenize = sequence_tokenizer(6)
+        tokens = tokenize(tf.constant([[b'ACGT'], [b'acgtnacgt']]))
+        np.testing.assert_array_equal(
+            tokens.numpy(),
+            [[2, 3, 4, 5, 0, 0],
+             [2, 3, 4, 5, 6, 2]]
+        )
+
+    def test_tokenize_vector(self):
+        tokenize = sequence_tokenizer(4)
+        tokens = tokenize(tf.constant([b'AXG', b'-']))
+        np.testing.assert_array_equal(
+            tokens.numpy(),
+            [[2, 1, 4, 0],
+             [1, 0, 0, 0]]
+        )
+
+    def test_combine_datasets(self):
+        samples = [[[b'AC'], [b'GT'], [b'N']], [[b'TTA']]]
+        seq_dataset = tf.data.Dataset.from_generator(
+            lambda: iter(samples),
+            output_signature=tf.TensorSpec([None, 1], tf.string)
+        ).apply(tf.data.experimental.assert_cardinality(len(samples)))
+        dist_dataset = tf.data.Dataset.from_tensor_slices([0.5, 1.5])
+        dataset = combine_datasets(
+            seq_dataset,
+            dist_dataset,
+            3,
+            add_index=True,
+            tokenize_batch_size=1
+        )
+        (ind_a, seq_a, dist_a), (ind_b, seq_b, dist_b) = list(
+            dataset.as_numpy_iterator()
+        )
+        self.assertEqual((ind_a, ind_b), (0, 1))
+        np.testing.assert_array_equal(
+            seq_a,
+            [[2, 3, 0], [4, 5, 0], [6, 0, 0]]
+        )
+        np.testing.assert_array_equal(seq_b, [[5, 5, 2]])
+        self.assertEqual((dist_a, dist_b), (0.5, 1.5))
+
+
+class TestBatchDataset(unittest.TestCase):
+
+    def test_pairwise_distances(self):
+        distances = tf.constant(
+            np.arange(16, dtype=np.float32).reshape(4, 4)
+        )
+        seq = tf.ones([4, 3, 100], dtype=tf.int64)
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (tf.range(4, dtype=tf.int64), seq)
+        )
+        batches = list(batch_dataset(
+            dataset,
+            2,
+            is_pairwise=True,
+            distances=distances
+        ).as_numpy_iterator())
+        self.assertEqual(len(batches), 2)
+        for ind, _, block in batches:
+            np.testing.assert_array_equal(
+                block,
+                distances.numpy()[np.ix_(ind, ind)]
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from math import comb
+import numpy as np
+import tensorflow as tf
+from aam.losses import pairwise_loss, pairwise_residual_mse
+
+
+def _squared_distances(embeddings):
+    diff = embeddings[:, None, :] - embeddings[None, :, :]
+    return np.sum(diff ** 2, axis=-1)
+
+
+class TestPairwiseLosses(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(12345)
+        self.batch_size = 8
+        self.embeddings = rng.normal(size=(self.batch_size, 4))
+        self.distances = np.abs(
+            rng.normal(size=(self.batch_size, self.batch_size))
+        )
+        self.y_true = rng.normal(size=(self.batch_size, 1))
+        self.y_pred = rng.normal(size=(self.batch_size, 1))
+
+    def test_pairwise_loss(self):
+        diff = np.square(np.square(self.distances)
+                         - _squared_distances(self.embeddings))
+        expected = np.sum(np.triu(diff)) / comb(self.batch_size, 2)
+
+        loss = pairwise_loss(self.batch_size)(
+            tf.constant(self.distances, dtype=tf.float32),
+            tf.constant(self.embeddings, dtype=tf.float32)
+        )
+        self.assertAlmostEqual(float(loss), expected, places=2)
+
+    def test_pairwise_loss_tiled(self):
+        y_true = tf.constant(self.distances, dtype=tf.float32)
+        y_pred = tf.constant(self.embeddings, dtype=tf.float32)
+        loss = pairwise_loss(self.batch_size)(y_true, y_pred)
+        tiled_loss = pairwise_loss(self.batch_size, tile_size=3)(
+            y_true,
+            y_pred
+        )
+        self.assertAlmostEqual(float(tiled_loss), float(loss), places=3)
+
+    def test_pairwise_loss_batch_size(self):
+        loss = pairwise_loss(self.batch_size, tile_size=3)
+        with self.assertRaises((ValueError, tf.errors.InvalidArgumentError)):
+            loss(
+                tf.constant(self.distances[:6, :6], dtype=tf.float32),
+                tf.constant(self.embeddings[:6], dtype=tf.float32)
+            )
+
+    def test_pairwise_residual_mse(self):
+        mean, std = 2.0, 3.0
+        y_true = np.squeeze(self.y_true * std + mean)
+        y_pred = np.squeeze(self.y_pred * std + mean)
+        mse = np.sum(np.square(y_true - y_pred)) / self.batch_size
+        r_true = np.abs(y_true[:, None] - y_true[None, :])
+        r_pred = np.abs(y_pred[:, None] - y_pred[None, :])
+        mrse = (np.sum(np.triu(np.square(r_true - r_pred)))
+                / comb(self.batch_size, 2))
+
+        loss = pairwise_residual_mse(self.batch_size, mean, std)(
+            tf.constant(self.y_true, dtype=tf.float32),
+            tf.constant(self.y_pred, dtype=tf.float32)
+        )
+        self.assertAlmostEqual(float(loss), mse + mrse, places=3)
+
+    def test_pairwise_residual_mse_batch_size(self):
+        loss = pairwise_residual_mse(self.batch_size)
+        with self.assertRaises((ValueError, tf.errors.InvalidArgumentError)):
+            loss(
+                tf.constant(self.y_true[:6], dtype=tf.float32),
+                tf.constant(self.y_pred[:6], dtype=tf.float32)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from math import comb
+import numpy as np
+import tensorflow as tf
+from aam.metrics import pairwise_mae
+
+
+class TestPairwiseMAE(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(12345)
+        self.batch_size = 8
+        self.embeddings = rng.normal(size=(self.batch_size, 4))
+        self.distances = np.abs(
+            rng.normal(size=(self.batch_size, self.batch_size))
+        )
+
+    def test_upper_triangle_mean(self):
+        diff = self.embeddings[:, None, :] - self.embeddings[None, :, :]
+        pred_dist = np.sqrt(np.sum(diff ** 2, axis=-1))
+        i_idx, j_idx = np.triu_indices(self.batch_size, k=1)
+        expected = (np.sum(np.abs(pred_dist - self.distances)[i_idx, j_idx])
+                    / comb(self.batch_size, 2))
+
+        metric = pairwise_mae(self.batch_size)
+        metric.update_state(
+            tf.constant(self.distances, dtype=tf.float32),
+            tf.constant(self.embeddings, dtype=tf.float32),
+            None
+        )
+        self.assertAlmostEqual(float(metric.result()), expected, places=4)
+
+    def test_batch_size(self):
+        metric = pairwise_mae(self.batch_size)
+        with self.assertRaises((ValueError, tf.errors.InvalidArgumentError)):
+            metric.update_state(
+                tf.constant(self.distances[:6, :6], dtype=tf.float32),
+                tf.constant(self.embeddings[:6], dtype=tf.float32),
+                None
+            )
+        # same number of entries, so the flattened gather stays in range
+        with self.assertRaises((ValueError, tf.errors.InvalidArgumentError)):
+            metric.update_state(
+                tf.constant(self.distances.reshape(4, 16), dtype=tf.float32),
+                tf.constant(self.embeddings, dtype=tf.float32),
+                None
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,7 @@ import tensorflow as tf
 import matplotlib.pyplot as plt
 import seaborn as sns
 from aam.losses import denormalize
+from aam.plotting import plot_mae_scatter, submit_plot
 
 
 def mean_confidence_interval(data, confidence=0.95):
@@ -16,60 +17,18 @@ def mean_confidence_interval(data, confidence=0.95):
     return m, h
 
 
-@tf.keras.saving.register_keras_serializable(
-    package="mean_absolute_error"
-)
-def mean_absolute_error(
-    dataset,
-    y,
-    hue,
-    hue_label,
-    model,
-    fname,
-    shift,
-    scale
-):
+def _predict_regression(predict_step, dataset, shift, scale):
     pred_val = []
     true_val = []
     for x, y in dataset:
-        inputs = model._get_inputs(x)
-        output = model(inputs)
-        pred_val.append(output['regression'])
+        pred_val.append(predict_step(x))
         true_val.append(y['reg_out'])
 
     pred_val = np.concatenate(pred_val)
     pred_val = pred_val*scale + shift
     true_val = np.concatenate(true_val)
     true_val = true_val*scale + shift
-    mae = np.mean(np.abs(true_val - pred_val))
-
-    min_x = np.min(true_val)
-    max_x = np.max(true_val)
-    coeff = np.polyfit(true_val, pred_val, deg=1)
-    p = np.poly1d(coeff)
-    xx = np.linspace(min_x, max_x, 50)
-    yy = p(xx)
-
-    diag = np.polyfit(true_val, true_val, deg=1)
-    p = np.poly1d(diag)
-    diag_xx = np.linspace(min_x, max_x, 50)
-    diag_yy = p(diag_xx)
-    data = {"pred": pred_val, "true": true_val}
-    if hue is not None:
-        data[hue_label] = hue
-        data = pd.DataFrame(data=data)
-        plot = sns.scatterplot(data, x="true", y="pred", hue=hue_label)
-    else:
-        data = pd.DataFrame(data=data)
-        plot = sns.scatterplot(data, x="true", y="pred")
-    plt.plot(xx, yy)
-    plt.plot(diag_xx, diag_yy)
-    mae = '%.4g' % mae
-    plot.set(xlabel='True')
-    plot.set(ylabel='Predicted')
-    plot.set(title=f"MAE: {mae}")
-    plt.savefig(fname)
-    plt.close()
+    return pred_val, true_val
 
 
 def violinplot(
@@ -219,25 +178,50 @@ class MAE_Scatter(tf.keras.callbacks.Callback):
         else:
             self.hue = None
 
+        self._plot = None
         if not os.path.exists(out_dir):
             os.makedirs(out_dir)
 
+    def set_model(self, model):
+        super().set_model(model)
+
+        # traced once here and reused by every report
+        @tf.function(reduce_retracing=True)
+        def predict_step(x):
+            return model(model._get_inputs(x))['regression']
+        self._predict_step = predict_step
+
     def on_epoch_end(self, epoch, logs=None):
         if epoch % self.report_back_after_epochs == 0:
-            mean_absolute_error(
+            # predict on the training thread, plot while the next epoch runs
+            pred_val, true_val = _predict_regression(
+                self._predict_step,
                 self.dataset,
-                self.y,
+                self.shift,
+                self.scale
+            )
+            self._wait_for_plot()
+            self._plot = submit_plot(
+                plot_mae_scatter,
+                pred_val,
+                true_val,
                 self.hue,
                 self.hue_label,
-                self.model,
                 fname=os.path.join(
                     self.out_dir, f'MAE-{self.title}.png'
-                    ),
-                shift=self.shift,
-                scale=self.scale
+                    )
             )
         return super().on_epoch_end(epoch, logs)
 
+    def on_train_end(self, logs=None):
+        self._wait_for_plot()
+        return super().on_train_end(logs)
+
+    def _wait_for_plot(self):
+        if self._plot is not None:
+            self._plot.result()
+            self._plot = None
+
     def get_config(self):
         base_config = super().get_config()
         config = {
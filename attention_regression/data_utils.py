@@ -1,6 +1,42 @@
+import os
 import numpy as np
 import tensorflow as tf
 from biom import load_table
+from aam.dataset_options import pipeline_options
+
+
+_local_data_service = {}
+
+
+def _start_local_data_service():
+    if not _local_data_service:
+        dispatcher = tf.data.experimental.service.DispatchServer()
+        dispatcher_address = dispatcher.target.split('://')[1]
+        worker = tf.data.experimental.service.WorkerServer(
+            tf.data.experimental.service.WorkerConfig(
+                dispatcher_address=dispatcher_address
+            )
+        )
+        # the servers shut down when garbage collected
+        _local_data_service['dispatcher'] = dispatcher
+        _local_data_service['worker'] = worker
+    return _local_data_service['dispatcher'].target
+
+
+def distribute_dataset(dataset, service):
+    """Run the preprocessing of `dataset` on tf.data service workers.
+    `service` is the address of a dispatcher, e.g. grpc://host:port, or
+    'local' to start a dispatcher and worker in this process.
+    """
+    if service == 'local':
+        service = _start_local_data_service()
+    return dataset.apply(
+        tf.data.experimental.service.distribute(
+            processing_mode="parallel_epochs",
+            service=service,
+            compression="AUTO"
+        )
+    )
 
 
 def load_biom_table(fp):
@@ -21,7 +57,7 @@ def convert_table_to_dataset(table):
     row_ind = table_coo.row
     col_ind = table_coo.col
     values = table_coo.data
-    indices = [[r, c] for r, c in zip(row_ind, col_ind)]
+    indices = np.stack((row_ind, col_ind), axis=1).astype(np.int64)
     sparse_tensor = tf.sparse.SparseTensor(
         indices=indices,
         values=values,
@@ -88,18 +124,37 @@ def tokenize_dataset(dataset, vocab):
     return tf.data.Dataset.zip((tokenized_ids, rclr_values))
 
 
-def batch_dataset(dataset, batch_size, repeat=None, shuffle=False):
-    def extract_zip(feature_rclr, target):
-        gx = tf.exp(tf.reduce_mean(tf.math.log(feature_rclr[1])))
-        inputs = {
-            "feature": feature_rclr[0],
-            "rclr": tf.math.log(
-                feature_rclr[1] / gx,
-            )
-        }
-        outputs = {"reg_out": target}
-        return (inputs, outputs)
+def feature_count_boundaries(table, num_buckets=4):
+    """Bucket boundaries that split the samples of `table` into roughly
+    equal sized groups by their number of features.
+    """
+    counts = table.nonzero_counts('sample', binary=True)
+    quantiles = np.linspace(0, 100, num_buckets + 1)[1:-1]
+    return np.unique(
+        np.percentile(counts, quantiles).astype(np.int64) + 1
+    ).tolist()
+
+
+def to_model_inputs(feature_rclr, target):
+    gx = tf.exp(tf.reduce_mean(tf.math.log(feature_rclr[1])))
+    inputs = {
+        "feature": feature_rclr[0],
+        "rclr": tf.math.log(
+            feature_rclr[1] / gx,
+        )
+    }
+    outputs = {"reg_out": target}
+    return (inputs, outputs)
 
+
+def batch_dataset(
+    dataset,
+    batch_size,
+    repeat=None,
+    shuffle=False,
+    bucket_boundaries=None,
+    drop_remainder=False
+):
     if shuffle:
         size = dataset.cardinality()
         dataset = dataset.shuffle(size, reshuffle_each_iteration=True)
@@ -121,36 +176,86 @@ def batch_dataset(dataset, batch_size, repeat=None, shuffle=False):
         "reg_out": tf.cast(0.0, dtype=tf.float32)
     }
 
-    dataset = (
-        dataset
-        .map(extract_zip)
-        .padded_batch(
+    if bucket_boundaries is None:
+        dataset = dataset.padded_batch(
             batch_size,
             padded_shapes=(input_pad, output_pad),
             padding_values=(input_pad_val, output_pad_val),
-            drop_remainder=False
+            drop_remainder=drop_remainder
+        )
+    else:
+        # samples with a similar number of features are batched together
+        # so less of each batch is padding
+        dataset = dataset.bucket_by_sequence_length(
+            lambda inputs, _: tf.shape(inputs["feature"])[0],
+            bucket_boundaries,
+            [batch_size] * (len(bucket_boundaries) + 1),
+            padded_shapes=(input_pad, output_pad),
+            padding_values=(input_pad_val, output_pad_val),
+            drop_remainder=drop_remainder
         )
+        if drop_remainder:
+            # unlike padded_batch the buckets do not carry the static batch
+            # size into the element spec
+            def set_batch_size(inputs, outputs):
+                inputs = {
+                    k: tf.ensure_shape(v, [batch_size, None])
+                    for k, v in inputs.items()
+                }
+                outputs = {
+                    k: tf.ensure_shape(v, [batch_size])
+                    for k, v in outputs.items()
+                }
+                return (inputs, outputs)
+            dataset = dataset.map(set_batch_size)
+    return (
+        dataset
         .prefetch(tf.data.AUTOTUNE)
+        .with_options(pipeline_options(shuffle))
     )
-    return dataset
 
 
 def train_val_split(
     dataset: tf.data.Dataset,
-    train_percent: float
+    train_percent: float,
+    cache_path: str = None,
+    snapshot_path: str = None,
+    size: int = None
 ):
-    size = dataset.cardinality().numpy()
+    if size is None:
+        size = dataset.cardinality().numpy()
+    else:
+        # the size is known up front so there is no need to ask the
+        # pipeline for it, only to check it in graph
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(size))
     train_size = int(size*train_percent)
-    training_dataset = (
-        dataset
-        .take(train_size)
-        .cache()
-        .prefetch(tf.data.AUTOTUNE)
+    # both splits are cached right away so skip only walks the upstream
+    # pipeline on the first epoch. Prefetching is left to the end of the
+    # pipeline in batch_dataset
+    training_dataset = _cache_split(
+        dataset.take(train_size),
+        'training',
+        cache_path,
+        snapshot_path
     )
-    validation_dataset = (
-        dataset
-        .skip(train_size)
-        .cache()
-        .prefetch(tf.data.AUTOTUNE)
+    validation_dataset = _cache_split(
+        dataset.skip(train_size),
+        'validation',
+        cache_path,
+        snapshot_path
     )
     return training_dataset, validation_dataset
+
+
+def _cache_split(dataset, split, cache_path, snapshot_path):
+    # file caches and snapshots are only kept once they have been read to
+    # the end, which is why they go after take/skip. Later runs replay them
+    # instead of running the upstream maps
+    if snapshot_path is not None:
+        dataset = dataset.snapshot(
+            os.path.join(snapshot_path, split),
+            compression='AUTO'
+        )
+    if cache_path is None:
+        return dataset.cache()
+    return dataset.cache(f'{cache_path}-{split}')
@@ -163,57 +163,26 @@ class FeatureEmbedding(tf.keras.layers.Layer):
             sample_rclr = rclr
         return (sample_tokens, sample_rclr, feature_mask)
 
-    def _random_mask(self, inputs):
-        sample_tokens, mask_rate, feature_mask = inputs
-        feature_count = tf.reduce_sum(
-            tf.cast(
-                feature_mask,
-                dtype=tf.int32
-            )
-        )
-
-        random_mask = tf.cast(
-            tf.math.greater_equal(
-                tf.random.uniform(
-                    shape=[feature_count]
-                ),
-                mask_rate
-            ),
-            dtype=tf.int64
-        )
-        random_mask = tf.pad(
-            random_mask,
-            [[0, tf.shape(sample_tokens)[0] - feature_count]]
-        )
-        sample_tokens = tf.multiply(
-            sample_tokens,
-            random_mask
-        )
-        return sample_tokens
-
     def _mask_features(self, inputs, training=None):
         feature, rclr = inputs
         feature_tokens = self.feature_tokens(feature)
         feature_mask = tf.not_equal(feature_tokens, 0)
 
         if training:
-            mask_rate = tf.repeat(
-                tf.cast(
-                    self.features_add_rate,
-                    dtype=tf.float32
+            # padded tokens are already 0 so the random mask can be drawn
+            # for the whole batch at once
+            random_mask = tf.cast(
+                tf.math.greater_equal(
+                    tf.random.uniform(
+                        shape=tf.shape(feature_tokens)
+                    ),
+                    self.features_add_rate
                 ),
-                repeats=[tf.shape(feature_tokens)[0]],
-                axis=0
+                dtype=tf.int64
             )
-
-            sample_tokens = tf.map_fn(
-                self._random_mask,
-                (
-                    feature_tokens,
-                    mask_rate,
-                    feature_mask
-                ),
-                fn_output_signature=tf.int64
+            sample_tokens = tf.multiply(
+                feature_tokens,
+                random_mask
             )
         else:
             sample_tokens = feature_tokens
@@ -309,7 +278,8 @@ class FeatureLoadings(tf.keras.layers.Layer):
             dropout_rate=dropout,
             norm_first=True,
             activation='relu')
-        self.binary_ff = tf.keras.layers.Dense(output_dim)
+        # logits are kept in float32 under a mixed precision policy
+        self.binary_ff = tf.keras.layers.Dense(output_dim, dtype=tf.float32)
 
     def call(self, inputs, training=None):
         output = inputs
@@ -478,7 +448,8 @@ class Regressor(tf.keras.layers.Layer):
         self.attention_heads = attention_heads
         self.dff = dff
         self.dropout = dropout
-        self.pca_layer = PCA(pca_heads)
+        # eigh has no float16 kernel so the PCA always runs in float32
+        self.pca_layer = PCA(pca_heads, dtype=tf.float32)
         self.position_encoder = tfm.nlp.layers.PositionEmbedding(
             d_model
         )
@@ -490,10 +461,10 @@ class Regressor(tf.keras.layers.Layer):
             intermediate_dropout=dropout,
             norm_first=True,
             activation='relu')
-        self.regress_ff = tf.keras.layers.Dense(1)
+        self.regress_ff = tf.keras.layers.Dense(1, dtype=tf.float32)
 
     def call(self, inputs, training=None):
-        output = self.pca_layer(inputs)
+        output = tf.cast(self.pca_layer(inputs), self.compute_dtype)
         output = output + self.position_encoder(output)
         output = self.encoder(output, training=training)
         output = output[:, -1, :]
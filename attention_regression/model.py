@@ -123,8 +123,9 @@ class AttentionRegression(tf.keras.Model):
         self.feature_attention_method = feature_attention_method
         self.binary_loadings = binary_loadings
         self.regressor = regressor
-        self.TRUE_CLASS = tf.constant(2, dtype=tf.int64)
-        self.ADDED_CLASS = tf.constant(1, dtype=tf.int64)
+        self.TRUE_CLASS = 2
+        self.ADDED_CLASS = 1
+        self._confidence_step = None
 
     def call(self, inputs, training=None):
         emb_outputs = self.feature_emb(inputs, training=training)
@@ -147,8 +148,8 @@ class AttentionRegression(tf.keras.Model):
                 "regression"
             ],
             "class_labels": {
-                "true":  2,
-                "added": 1
+                "true": self.TRUE_CLASS,
+                "added": self.ADDED_CLASS
             },
             "total_tokens": self.feature_emb.total_tokens
         }
@@ -163,19 +164,6 @@ class AttentionRegression(tf.keras.Model):
         y_pred = self((inputs), training=False)
         return y_pred
 
-    @tf.function
-    def select_equal_class(self, inputs):
-        embeddings, labels, max_added = inputs
-        added_embeddings = embeddings[-max_added:]
-        added_labels = labels[-max_added:]
-
-        true_embeddings = embeddings[:max_added]
-        true_labels = labels[:max_added]
-        return (
-            tf.concat((true_embeddings, added_embeddings), axis=0),
-            tf.concat((true_labels, added_labels), axis=0),
-        )
-
     def _add_feature_loss(self, model_outputs):
         # extract feature labels
         _, token_mask, tokens, embeddings = model_outputs
@@ -183,28 +171,39 @@ class AttentionRegression(tf.keras.Model):
             tf.cast(tf.greater(tokens, 0), dtype=tf.int64),
             tf.cast(token_mask, dtype=tf.int64)
         )
-        max_added = tf.repeat(
-            tf.reduce_max(
-                tf.reduce_sum(
-                    tf.cast(
-                        tf.equal(labels, 1),
-                        dtype=tf.int64
-                    ),
-                    axis=1
-                )
-            ),
-            repeats=[tf.shape(tokens)[0]],
-            axis=0
+        max_added = tf.reduce_max(
+            tf.reduce_sum(
+                tf.cast(
+                    tf.equal(labels, self.ADDED_CLASS),
+                    dtype=tf.int64
+                ),
+                axis=1
+            )
         )
 
-        embeddings, labels = tf.vectorized_map(
-            self.select_equal_class,
-            [embeddings, labels, max_added]
-        )
+        def _equal_class_loss():
+            # max_added is shared by the whole batch so selecting an equal
+            # number of true and added tokens is two slices on the batched
+            # tensors
+            class_embeddings = tf.concat(
+                (embeddings[:, :max_added], embeddings[:, -max_added:]),
+                axis=1
+            )
+            class_labels = tf.concat(
+                (labels[:, :max_added], labels[:, -max_added:]),
+                axis=1
+            )
+            return tf.reduce_mean(
+                self.attention_loss(class_labels, class_embeddings),
+                axis=-1
+            )
 
-        attention_loss = tf.reduce_mean(
-            self.attention_loss(labels, embeddings),
-            axis=-1
+        # without added tokens there is nothing to balance against and the
+        # slices above would select the whole sequence, so skip the loss
+        attention_loss = tf.cond(
+            tf.equal(max_added, 0),
+            lambda: tf.zeros([tf.shape(embeddings)[0]], dtype=tf.float32),
+            _equal_class_loss
         )
         return attention_loss
 
@@ -267,9 +266,15 @@ class AttentionRegression(tf.keras.Model):
             loss += attention_loss
             self.loss_tracker.update_state(loss)
 
+            scaled_loss = loss
+            if self._loss_scaled:
+                scaled_loss = self.optimizer.get_scaled_loss(loss)
+
         # Compute gradients
         trainable_vars = self.trainable_variables
-        gradients = tape.gradient(loss, trainable_vars)
+        gradients = tape.gradient(scaled_loss, trainable_vars)
+        if self._loss_scaled:
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
 
         # Update weights
         self.optimizer.apply_gradients(zip(gradients, trainable_vars))
@@ -283,6 +288,14 @@ class AttentionRegression(tf.keras.Model):
             "mae": self.mae_metric.result(),
         }
 
+    @property
+    def _loss_scaled(self):
+        # compile wraps the optimizer when a mixed_float16 policy is set
+        return isinstance(
+            self.optimizer,
+            tf.keras.mixed_precision.LossScaleOptimizer
+        )
+
     def build(self, input_shape):
         feature_input = tf.keras.Input(
             shape=[None],
@@ -339,6 +352,31 @@ class AttentionRegression(tf.keras.Model):
                         dtype=tf.float32
                     )
 
+        # the step is built once so later calls, e.g. every epoch from
+        # AvgFeatureConfidence, reuse its trace
+        if self._confidence_step is None:
+            self._confidence_step = self._build_confidence_step()
+
+        classes = tuple(conf_dict["classes"])
+        class_dicts = {c: conf_dict[c] for c in classes}
+        for x, y in dataset:
+            class_dicts = self._confidence_step(x, y, class_dicts, classes)
+        conf_dict.update(class_dicts)
+
+        for c in conf_dict["classes"]:
+            class_dict = conf_dict[c]
+            for k in conf_dict["conf_keys"]:
+                if k == "count":
+                    continue
+                token_counts = class_dict["count"]
+                if k == "age":
+                    class_dict[k]["true_age"] /= token_counts
+                    class_dict[k]["predicted_age"] /= token_counts
+                else:
+                    class_dict[k] /= token_counts
+        return conf_dict
+
+    def _build_confidence_step(self):
         def _normalize_age(tensor):
             return self.scale * tensor + self.shift
 
@@ -352,14 +390,6 @@ class AttentionRegression(tf.keras.Model):
             )
             return cls_mask, class_tokens
 
-        def _map_sample_tokens(inputs):
-            sampe_confidence, sample_tokens = inputs
-            return tf.scatter_nd(
-                tf.expand_dims(sample_tokens, axis=-1),
-                sampe_confidence,
-                shape=[self.feature_emb.total_tokens]
-            )
-
         def map_to_tokens(
                 batch_tensor,
                 class_mask,
@@ -371,18 +401,19 @@ class AttentionRegression(tf.keras.Model):
                 tf.cast(class_mask, dtype=tf.float32)
             )
 
-            # map the class_tensor to the respective token indices
-            batch_token_tensor = tf.reduce_sum(
-                tf.map_fn(
-                    _map_sample_tokens,
-                    (class_tensor, class_tokens),
-                    fn_output_signature=tf.float32
-                ),
-                axis=0
+            # scatter-add the whole batch into the respective token indices
+            batch_token_tensor = tf.math.unsorted_segment_sum(
+                tf.reshape(class_tensor, [-1]),
+                tf.reshape(class_tokens, [-1]),
+                num_segments=self.feature_emb.total_tokens
             )
             return batch_token_tensor
 
-        def _process_batch(x, y):
+        @tf.function(reduce_retracing=True)
+        def _process_batch(x, y, class_dicts, classes):
+            # accumulators are threaded through the function so the whole
+            # batch update runs as one staged graph
+            class_dicts = tf.nest.map_structure(tf.identity, class_dicts)
             inputs = self._get_inputs(x)
             model_outputs = self(inputs)
 
@@ -399,7 +430,7 @@ class AttentionRegression(tf.keras.Model):
                 model_outputs["embeddings"]
             )
 
-            for c in conf_dict["classes"]:
+            for c in classes:
                 class_mask, class_tokens = _process_class_masks(
                     model_outputs["token_mask"],
                     model_outputs["tokens"],
@@ -411,7 +442,7 @@ class AttentionRegression(tf.keras.Model):
                         model_outputs["embeddings"][:, :, cls_val],
                         tf.cast(class_mask, dtype=tf.float32)
                 )
-                conf_dict[c]["confidence"] += map_to_tokens(
+                class_dicts[c]["confidence"] += map_to_tokens(
                     batch_confidence,
                     class_mask,
                     class_tokens
@@ -419,7 +450,7 @@ class AttentionRegression(tf.keras.Model):
 
                 ones = tf.ones_like(model_outputs["tokens"], dtype=tf.float32)
 
-                conf_dict[c]["age"]["true_age"] += map_to_tokens(
+                class_dicts[c]["age"]["true_age"] += map_to_tokens(
                     tf.multiply(
                         model_outputs["true_age"],
                         ones
@@ -427,7 +458,7 @@ class AttentionRegression(tf.keras.Model):
                     class_mask,
                     class_tokens
                 )
-                conf_dict[c]["age"]["predicted_age"] += map_to_tokens(
+                class_dicts[c]["age"]["predicted_age"] += map_to_tokens(
                     tf.multiply(
                         model_outputs["predicted_age"],
                         ones
@@ -436,27 +467,15 @@ class AttentionRegression(tf.keras.Model):
                     class_tokens
                 )
 
-                conf_dict[c]["count"] += map_to_tokens(
+                class_dicts[c]["count"] += map_to_tokens(
                     ones,
                     class_mask,
                     class_tokens
                 )
 
-        for batch in dataset:
-            _process_batch(*batch)
+            return class_dicts
 
-        for c in conf_dict["classes"]:
-            class_dict = conf_dict[c]
-            for k in conf_dict["conf_keys"]:
-                if k == "count":
-                    continue
-                token_counts = class_dict["count"]
-                if k == "age":
-                    class_dict[k]["true_age"] /= token_counts
-                    class_dict[k]["predicted_age"] /= token_counts
-                else:
-                    class_dict[k] /= token_counts
-        return conf_dict
+        return _process_batch
 
     def get_config(self):
         base_config = super().get_config()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import tensorflow as tf
+from attention_regression.data_utils import train_val_split
+
+
+class TestTrainValSplit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _dataset(self):
+        def count(x):
+            self.calls.append(1)
+            return x
+
+        def upstream(x):
+            return tf.py_function(count, [x], tf.int64)
+        return tf.data.Dataset.range(10).map(upstream)
+
+    def _split(self, **kwargs):
+        training, validation = train_val_split(
+            self._dataset(),
+            train_percent=0.8,
+            size=10,
+            **kwargs
+        )
+        return (list(training.as_numpy_iterator()),
+                list(validation.as_numpy_iterator()))
+
+    def test_split(self):
+        training, validation = self._split()
+        np.testing.assert_array_equal(training, np.arange(8))
+        np.testing.assert_array_equal(validation, [8, 9])
+
+    def test_cache_replayed(self):
+        cache_path = os.path.join(self.tmp_dir, 'dataset.cache')
+        first = self._split(cache_path=cache_path)
+        calls = len(self.calls)
+        self.assertGreater(calls, 0)
+
+        second = self._split(cache_path=cache_path)
+        self.assertEqual(len(self.calls), calls)
+        for a, b in zip(first, second):
+            np.testing.assert_array_equal(a, b)
+
+    def test_training_cache_replayed(self):
+        # only the training split is read, so nothing downstream of take
+        # reaches the end of the upstream dataset
+        cache_path = os.path.join(self.tmp_dir, 'dataset.cache')
+        for _ in range(2):
+            training, _ = train_val_split(
+                self._dataset(),
+                train_percent=0.8,
+                size=10,
+                cache_path=cache_path
+            )
+            training = list(training.as_numpy_iterator())
+            np.testing.assert_array_equal(training, np.arange(8))
+        self.assertEqual(len(self.calls), 8)
+
+    def test_snapshot_replayed(self):
+        # snapshots are keyed on the graph of the upstream pipeline, so both
+        # runs share the same one
+        snapshot_path = os.path.join(self.tmp_dir, 'snapshot')
+        dataset = self._dataset()
+        for _ in range(2):
+            training, _ = train_val_split(
+                dataset,
+                train_percent=0.8,
+                size=10,
+                snapshot_path=snapshot_path
+            )
+            training = list(training.as_numpy_iterator())
+            np.testing.assert_array_equal(training, np.arange(8))
+        self.assertEqual(len(self.calls), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,8 @@ from aam.cli_util import aam_model_options
 from attention_regression.data_utils import (
     load_biom_table, shuffle_table, filter_and_reorder, extract_col,
     convert_table_to_dataset, batch_dataset, convert_to_normalized_dataset,
-    train_val_split
+    train_val_split, distribute_dataset, feature_count_boundaries,
+    to_model_inputs
 )
 from attention_regression.model import _construct_model
 from attention_regression.callbacks import MAE_Scatter
@@ -27,9 +28,29 @@ def _create_dataset(
     m_metadata_file,
     m_metadata_column,
     p_normalize,
-    p_missing_samples
+    p_missing_samples,
+    p_cache_dir=None,
+    p_snapshot_dir=None
 ):
-    table = shuffle_table(load_biom_table(i_table_path))
+    table = load_biom_table(i_table_path)
+    cache_path = None
+    snapshot_path = None
+    if p_cache_dir is None and p_snapshot_dir is None:
+        table = shuffle_table(table)
+    else:
+        # the cached sample order is replayed on later runs so the table is
+        # kept in its stored order to keep the sample ids aligned with it
+        dataset_name = '-'.join([
+            os.path.basename(i_table_path),
+            m_metadata_column,
+            p_normalize
+        ])
+        if p_cache_dir is not None:
+            if not os.path.exists(p_cache_dir):
+                os.makedirs(p_cache_dir)
+            cache_path = os.path.join(p_cache_dir, f'{dataset_name}.cache')
+        if p_snapshot_dir is not None:
+            snapshot_path = os.path.join(p_snapshot_dir, dataset_name)
     metadata = pd.read_csv(
         m_metadata_file, sep='\t',
         index_col=0
@@ -64,10 +85,19 @@ def _create_dataset(
         regression_data,
         p_normalize
     )
-    full_dataset = tf.data.Dataset.zip((feature_dataset, regression_dataset))
+    # the log ratios only depend on the sample so they are computed before
+    # the split is cached and only the shuffle and batching run each epoch
+    full_dataset = (
+        tf.data.Dataset
+        .zip((feature_dataset, regression_dataset))
+        .map(to_model_inputs, num_parallel_calls=tf.data.AUTOTUNE)
+    )
     training, _ = train_val_split(
         full_dataset,
-        train_percent=1.
+        train_percent=1.,
+        cache_path=cache_path,
+        snapshot_path=snapshot_path,
+        size=len(ids)
     )
     return {
         'dataset': training,
@@ -113,6 +143,30 @@ def _create_dataset(
     type=click.Choice(['error', 'ignore'], case_sensitive=False),
     help=desc.MISSING_SAMPLES_DESC
 )
+@click.option(
+    '--p-cache-dir',
+    default=None,
+    help=desc.CACHE_DIR_DESC,
+    type=click.Path()
+)
+@click.option(
+    '--p-snapshot-dir',
+    default=None,
+    help=desc.SNAPSHOT_DIR_DESC,
+    type=click.Path()
+)
+@click.option(
+    '--p-bucket-batches/--p-no-bucket-batches',
+    default=False,
+    show_default=True,
+    help=desc.BUCKET_BATCHES_DESC
+)
+@click.option(
+    '--p-data-service',
+    default=None,
+    help=desc.DATA_SERVICE_DESC,
+    type=str
+)
 @aam_model_options
 @click.option(
     '--p-output-dir',
@@ -125,8 +179,13 @@ def fit_regressor(
     m_metadata_hue: str,
     p_normalize: str,
     p_missing_samples: str,
+    p_cache_dir: str,
+    p_snapshot_dir: str,
+    p_bucket_batches: bool,
+    p_data_service: str,
     p_batch_size: int,
     p_epochs: int,
+    p_warmup_epochs: int,
     p_repeat: int,
     p_dropout: float,
     p_token_dim: int,
@@ -139,6 +198,8 @@ def fit_regressor(
     p_enc_heads: int,
     p_lr: float,
     p_report_back_after: int,
+    p_xla: bool,
+    p_mixed_precision: bool,
     p_output_dir: str
 ):
     if not os.path.exists(p_output_dir):
@@ -153,19 +214,31 @@ def fit_regressor(
         m_metadata_file,
         m_metadata_column,
         p_normalize,
-        p_missing_samples
+        p_missing_samples,
+        p_cache_dir,
+        p_snapshot_dir
     )
     training = dataset_obj['dataset']
     ids = dataset_obj['sample_ids']
-    training_size = training.cardinality().numpy()
-    training_ids = ids[:training_size]
+    # the whole dataset is used for training
+    training_ids = ids
 
+    bucket_boundaries = None
+    if p_bucket_batches:
+        bucket_boundaries = feature_count_boundaries(dataset_obj['table'])
     training_dataset = batch_dataset(
         training,
         p_batch_size,
         repeat=p_repeat,
-        shuffle=True
+        shuffle=True,
+        bucket_boundaries=bucket_boundaries,
+        drop_remainder=True
     )
+    if p_data_service is not None:
+        training_dataset = distribute_dataset(
+            training_dataset,
+            p_data_service
+        )
     training_no_shuffle = batch_dataset(
         training,
         p_batch_size,
@@ -176,6 +249,14 @@ def fit_regressor(
     mean = dataset_obj['mean']
     std = dataset_obj['std']
     metadata = dataset_obj['metadata']
+    if p_xla is None:
+        p_xla = len(tf.config.list_physical_devices('GPU')) > 0
+    if p_xla:
+        # the train step looks up string features, which XLA cannot
+        # compile, so only the ops XLA supports are clustered
+        tf.config.optimizer.set_jit('autoclustering')
+    if p_mixed_precision:
+        tf.keras.mixed_precision.set_global_policy('mixed_float16')
     model = _construct_model(
         table.ids(axis='observation').tolist(),
         mean,
@@ -219,7 +300,9 @@ def fit_regressor(
         ),
         tf.keras.callbacks.EarlyStopping(
             'loss',
-            patience=50
+            min_delta=1e-4,
+            patience=50,
+            start_from_epoch=p_warmup_epochs
         ),
         SaveModel(p_output_dir)
     ]